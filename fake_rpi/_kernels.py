@@ -0,0 +1,36 @@
+"""
+Optional Numba kernels for the fake NeoPixel driver
+====================================================
+
+numba is only imported, and the kernels compiled, the first time a caller
+asks for one. Callers fall back to NumPy when numba is not installed.
+"""
+
+_dotstar_kernel = None
+_dotstar_resolved = False
+
+
+def _apply_brightness_dotstar(pre, post, start, stop, q8, step, lum):
+    """
+    Scale the bytes in [start, stop) of a DotStar buffer, skipping the
+    luminance byte at position ``lum`` of every ``step`` byte pixel.
+    """
+    for i in range(start, stop):
+        if (i - start) % step != lum:
+            post[i] = (pre[i] * q8) >> 8
+
+
+def dotstar_brightness_kernel():
+    """
+    :return: the compiled DotStar brightness kernel, or None without numba.
+    """
+    global _dotstar_kernel, _dotstar_resolved
+    if not _dotstar_resolved:
+        _dotstar_resolved = True
+        try:
+            from numba import njit  # type: ignore
+        except ImportError:
+            pass
+        else:
+            _dotstar_kernel = njit(cache=True, fastmath=False)(_apply_brightness_dotstar)
+    return _dotstar_kernel
@@ -5,8 +5,22 @@ Fake NeoPixel strip driver
 * Author(s): Fredrik Lofgren
 """
 
-from .wrappers import printf
+from array import array
+import numpy as np  # type: ignore
 from .Base import Base
+from . import _kernels
+
+# DotStar LED start frame: three "1" bits followed by 5 brightness bits
+DOTSTAR_LED_START_FULL_BRIGHT = 0xFF
+DOTSTAR_LED_START = 0b11100000
+DOTSTAR_LED_BRIGHTNESS = 0b00011111
+
+# Brightness lookup table for full brightness
+_IDENTITY_LUT = bytes(range(256))
+
+# Below this many pixels NumPy setup costs more than a per-pixel loop
+_VECTOR_MIN_PIXELS = 16
+
 # Pixel color order constants
 RGB = "RGB"
 """Red Green Blue"""
@@ -31,8 +45,6 @@ class NeoPixel(Base):
                 pixel_order = "".join(order_list)
         byteorder=pixel_order
 
-        header=None
-        trailer=None
         bpp, byteorder_tuple, has_white, dotstar_mode = self._parse_byteorder(byteorder)
         
         self.auto_write = False
@@ -42,17 +54,6 @@ class NeoPixel(Base):
         buf = bytearray(_bytes)
         offset = 0
 
-        if header is not None:
-            if not isinstance(header, bytearray):
-                raise TypeError("header must be a bytearray")
-            buf = header + buf
-            offset = len(header)
-
-        if trailer is not None:
-            if not isinstance(trailer, bytearray):
-                raise TypeError("trailer must be a bytearray")
-            buf += trailer
-
         self._pixels = n
         self._bytes = _bytes
         self._byteorder = byteorder_tuple
@@ -64,6 +65,13 @@ class NeoPixel(Base):
         self._offset = offset
         self._dotstar_mode = dotstar_mode
         self._pixel_step = effective_bpp
+        # Start of every pixel in the buffer
+        self._offsets = array(
+            "H" if offset + _bytes < 65536 else "I",
+            range(offset, offset + _bytes, effective_bpp),
+        )
+        # Byte columns scaled by brightness, per-pixel luminance bytes are not
+        self._color_columns = list(byteorder_tuple[:3] if dotstar_mode else byteorder_tuple)
 
         if dotstar_mode:
             self._byteorder_tuple = (
@@ -73,11 +81,30 @@ class NeoPixel(Base):
                 0,
             )
             # Initialize the buffer with the dotstar start bytes.
-            for i in range(self._offset, self._bytes + self._offset, 4):
+            lum = self._offset + byteorder_tuple[3]
+            for i in range(lum, self._bytes + self._offset, 4):
                 self._post_brightness_buffer[i] = DOTSTAR_LED_START_FULL_BRIGHT
+            self._parse_color = self._parse_color_dotstar4
+        elif has_white:
+            self._parse_color = self._parse_color_rgbw4
+        else:
+            self._parse_color = self._parse_color_rgb3
+        self._fill = self._fill_rgb3 if bpp == 3 else self._fill_bpp4
 
         self._brightness = 1.0
-        self.brightness = brightness
+        self._brightness_q8 = 256
+        self._lut = _IDENTITY_LUT
+        brightness = self._brightness_change(brightness)
+        if brightness is not None:
+            # No pixels are set yet, so there is nothing to rescale and a
+            # NeoPixel buffer can start out blank instead of as a copy
+            self._set_brightness(brightness)
+            self._pre_brightness_buffer = (
+                bytearray(self._post_brightness_buffer)
+                if dotstar_mode
+                else bytearray(len(self._post_brightness_buffer))
+            )
+        self._bind_set_item()
 
         self.auto_write = auto_write
 
@@ -143,29 +170,73 @@ class NeoPixel(Base):
 
     @brightness.setter
     def brightness(self, value):
-        value = min(max(value, 0.0), 1.0)
-        change = value - self._brightness
-        if -0.001 < change < 0.001:
+        value = self._brightness_change(value)
+        if value is None:
             return
 
-        self._brightness = value
-
-        if self._pre_brightness_buffer is None:
-            self._pre_brightness_buffer = bytearray(self._post_brightness_buffer)
+        self._set_brightness(value)
 
         # Adjust brightness of existing pixels
-        offset_check = self._offset % self._pixel_step
-        for i in range(self._offset, self._bytes + self._offset):
-            # Don't adjust per-pixel luminance bytes in dotstar mode
-            if self._dotstar_mode and (i % 4 != offset_check):
-                continue
-            self._post_brightness_buffer[i] = int(
-                self._pre_brightness_buffer[i] * self._brightness
-            )
+        start = self._offset
+        stop = self._offset + self._bytes
+        pre = self._pre_brightness_buffer
+        if self._brightness_q8 == 256:
+            # Back at full brightness the second buffer is not needed anymore
+            if pre is not None:
+                self._post_brightness_buffer[start:stop] = pre[start:stop]
+            self._pre_brightness_buffer = None
+        else:
+            if pre is None:
+                pre = self._pre_brightness_buffer = bytearray(self._post_brightness_buffer)
+            if not self._dotstar_mode:
+                # Every byte is a color channel, so the table maps the whole buffer
+                self._post_brightness_buffer[start:stop] = pre[start:stop].translate(self._lut)
+            else:
+                # Compiling the numba kernel only pays off on long strips
+                kernel = _kernels.dotstar_brightness_kernel() if self._bytes > 256 else None
+                if kernel is not None:
+                    kernel(
+                        np.frombuffer(pre, dtype=np.uint8),
+                        np.frombuffer(self._post_brightness_buffer, dtype=np.uint8),
+                        start,
+                        stop,
+                        self._brightness_q8,
+                        self._pixel_step,
+                        self._byteorder[3],
+                    )
+                else:
+                    # Only the color columns, per-pixel luminance bytes are left alone
+                    columns = self._color_columns
+                    lut = np.frombuffer(self._lut, dtype=np.uint8)
+                    post = self._pixel_view(self._post_brightness_buffer)
+                    post[:, columns] = lut[self._pixel_view(pre)[:, columns]]
+        self._bind_set_item()
 
         if self.auto_write:
             self.show()
 
+    def _brightness_change(self, value):
+        """
+        Clamp a requested brightness to 0 - 1.0.
+
+        :return: the clamped value, or None if it is within 0.001 of the current brightness.
+        """
+        value = min(max(value, 0.0), 1.0)
+        change = value - self._brightness
+        if -0.001 < change < 0.001:
+            return None
+        return value
+
+    def _set_brightness(self, value):
+        """Update the brightness and its scale and lookup table."""
+        self._brightness = value
+        q8 = self._brightness_q8 = int(value * 256)
+        # Scaled value for every possible channel byte
+        if q8 == 256:
+            self._lut = _IDENTITY_LUT
+        else:
+            self._lut = ((np.arange(256, dtype=np.uint16) * q8) >> 8).astype(np.uint8).tobytes()
+
     @property
     def byteorder(self):
         """
@@ -191,94 +262,188 @@ class NeoPixel(Base):
         :param pixelbuf: A pixel object.
         :param color: Color to set.
         """
-        r, g, b, w = self._parse_color(color)
-        for i in range(self._pixels):
-            self._set_item(i, r, g, b, w)
+        self._fill(color)
         if self.auto_write:
             self.show()
 
-    def _parse_color(self, value):
-        r = 0
-        g = 0
-        b = 0
-        w = 0
-        if isinstance(value, int):
-            r = value >> 16
-            g = (value >> 8) & 0xFF
-            b = value & 0xFF
-            w = 0
+    def _fill_rgb3(self, color):
+        """fill() for 3 byte pixels, one byte-ordered pixel repeated down the strip."""
+        r, g, b, _ = self._parse_color_rgb3(color)
+        bo0, bo1, bo2 = self._byteorder
+        start = self._offset
+        stop = self._offset + self._bytes
+
+        template = bytearray(3)
+        template[bo0] = r
+        template[bo1] = g
+        template[bo2] = b
+        if self._pre_brightness_buffer is not None:
+            memoryview(self._pre_brightness_buffer)[start:stop] = template * self._pixels
+            lut = self._lut
+            template[bo0] = lut[r]
+            template[bo1] = lut[g]
+            template[bo2] = lut[b]
+        memoryview(self._post_brightness_buffer)[start:stop] = template * self._pixels
+
+    def _fill_bpp4(self, color):
+        """fill() for 4 byte RGBW and DotStar pixels."""
+        r, g, b, w = self._parse_color(color)
+        bo0, bo1, bo2, bo3 = self._byteorder
+        start = self._offset
+        stop = self._offset + self._bytes
+
+        template = bytearray(4)
+        template[bo3] = w
+        template[bo0] = r
+        template[bo1] = g
+        template[bo2] = b
+        if self._pre_brightness_buffer is not None:
+            memoryview(self._pre_brightness_buffer)[start:stop] = template * self._pixels
+            lut = self._lut
+            # Only apply brightness if w is actually white (aka not DotStar.)
+            if not self._dotstar_mode:
+                template[bo3] = lut[w]
+            template[bo0] = lut[r]
+            template[bo1] = lut[g]
+            template[bo2] = lut[b]
+        memoryview(self._post_brightness_buffer)[start:stop] = template * self._pixels
 
-            if self._dotstar_mode:
-                w = 1.0
+    def _parse_color_rgb3(self, value):
+        if isinstance(value, int):
+            r, g, b = (value & 0xFFFFFF).to_bytes(3, "big")
+            return (r, g, b, 0)
+        if len(value) != 3:
+            raise ValueError("Expected tuple of length 3, got {}".format(len(value)))
+        r, g, b = value
+        return (r, g, b, 0)
+
+    def _parse_color_rgbw4(self, value):
+        if isinstance(value, int):
+            r, g, b = (value & 0xFFFFFF).to_bytes(3, "big")
+        elif len(value) == 4:
+            return tuple(value)
+        elif len(value) == 3:
+            r, g, b = value
         else:
-            if len(value) < 3 or len(value) > 4:
-                raise ValueError(
-                    "Expected tuple of length {}, got {}".format(self._bpp, len(value))
-                )
-            if len(value) == self._bpp:
-                if self._bpp == 3:
-                    r, g, b = value
-                else:
-                    r, g, b, w = value
-            elif len(value) == 3:
-                r, g, b = value
-                if self._dotstar_mode:
-                    w = 1.0
+            raise ValueError("Expected tuple of length 4, got {}".format(len(value)))
 
-        if self._bpp == 4:
-            if self._dotstar_mode:
-                # LED startframe is three "1" bits, followed by 5 brightness bits
-                # then 8 bits for each of R, G, and B. The order of those 3 are configurable and
-                # vary based on hardware
-                w = (int(w * 31) & 0b00011111) | DOTSTAR_LED_START
-            elif (
-                self._has_white
-                and (isinstance(value, int) or len(value) == 3)
-                and r == g
-                and g == b
-            ):
-                # If all components are the same and we have a white pixel then use it
-                # instead of the individual components when all 4 values aren't explicitly given.
-                w = r
-                r = 0
-                g = 0
-                b = 0
+        if r == g and g == b:
+            # If all components are the same and we have a white pixel then use it
+            # instead of the individual components when all 4 values aren't explicitly given.
+            return (0, 0, 0, r)
+        return (r, g, b, 0)
 
+    def _parse_color_dotstar4(self, value):
+        w = 1.0
+        if isinstance(value, int):
+            r, g, b = (value & 0xFFFFFF).to_bytes(3, "big")
+        elif len(value) == 4:
+            r, g, b, w = value
+        elif len(value) == 3:
+            r, g, b = value
+        else:
+            raise ValueError("Expected tuple of length 4, got {}".format(len(value)))
+
+        # LED startframe is three "1" bits, followed by 5 brightness bits
+        # then 8 bits for each of R, G, and B. The order of those 3 are configurable and
+        # vary based on hardware
+        w = (int(w * 31) & DOTSTAR_LED_BRIGHTNESS) | DOTSTAR_LED_START
         return (r, g, b, w)
 
-    def _set_item(self, index, r, g, b, w):
-        if index < 0:
-            index += len(self)
-        if index >= self._pixels or index < 0:
-            raise IndexError
-        offset = self._offset + (index * self._bpp)
+    def _bind_set_item(self):
+        """
+        Bind ``_set_item`` to a writer specialized for the pixel layout, with
+        the buffers and brightness table captured. Call again whenever the
+        brightness or the pre-brightness buffer changes.
 
-        if self._pre_brightness_buffer is not None:
-            if self._bpp == 4:
-                self._pre_brightness_buffer[offset + self._byteorder[3]] = w
-            self._pre_brightness_buffer[offset + self._byteorder[0]] = r
-            self._pre_brightness_buffer[offset + self._byteorder[1]] = g
-            self._pre_brightness_buffer[offset + self._byteorder[2]] = b
+        The pre-brightness buffer only exists while brightness is below 1.0,
+        so colors are scaled exactly when it is present.
+        """
+        pixels = self._pixels
+        offsets = self._offsets
+        pre = self._pre_brightness_buffer
+        buf = self._post_brightness_buffer
+        lut = self._lut
+
+        if self._bpp == 3:
+            bo0, bo1, bo2 = self._byteorder
+
+            def _set_rgb3(index, r, g, b, w):
+                if index < 0:
+                    index += pixels
+                if index >= pixels or index < 0:
+                    raise IndexError
+                offset = offsets[index]
+                if pre is not None:
+                    pre[offset + bo0] = r
+                    pre[offset + bo1] = g
+                    pre[offset + bo2] = b
+                    r = lut[r]
+                    g = lut[g]
+                    b = lut[b]
+                buf[offset + bo0] = r
+                buf[offset + bo1] = g
+                buf[offset + bo2] = b
+
+            self._set_item = _set_rgb3
+            return
 
-        if self._bpp == 4:
-            # Only apply brightness if w is actually white (aka not DotStar.)
-            if not self._dotstar_mode:
-                w = int(w * self._brightness)
-            self._post_brightness_buffer[offset + self._byteorder[3]] = w
+        bo0, bo1, bo2, bo3 = self._byteorder
+
+        if self._dotstar_mode:
+
+            def _set_dotstar4(index, r, g, b, w):
+                if index < 0:
+                    index += pixels
+                if index >= pixels or index < 0:
+                    raise IndexError
+                offset = offsets[index]
+                if pre is not None:
+                    pre[offset + bo3] = w
+                    pre[offset + bo0] = r
+                    pre[offset + bo1] = g
+                    pre[offset + bo2] = b
+                    # The luminance byte is never scaled
+                    r = lut[r]
+                    g = lut[g]
+                    b = lut[b]
+                buf[offset + bo3] = w
+                buf[offset + bo0] = r
+                buf[offset + bo1] = g
+                buf[offset + bo2] = b
+
+            self._set_item = _set_dotstar4
+            return
 
-        self._post_brightness_buffer[offset + self._byteorder[0]] = int(
-            r * self._brightness
-        )
-        self._post_brightness_buffer[offset + self._byteorder[1]] = int(
-            g * self._brightness
-        )
-        self._post_brightness_buffer[offset + self._byteorder[2]] = int(
-            b * self._brightness
-        )
+        def _set_rgbw4(index, r, g, b, w):
+            if index < 0:
+                index += pixels
+            if index >= pixels or index < 0:
+                raise IndexError
+            offset = offsets[index]
+            if pre is not None:
+                pre[offset + bo3] = w
+                pre[offset + bo0] = r
+                pre[offset + bo1] = g
+                pre[offset + bo2] = b
+                w = lut[w]
+                r = lut[r]
+                g = lut[g]
+                b = lut[b]
+            buf[offset + bo3] = w
+            buf[offset + bo0] = r
+            buf[offset + bo1] = g
+            buf[offset + bo2] = b
+
+        self._set_item = _set_rgbw4
 
     def __setitem__(self, index, val):
         if isinstance(index, slice):
             start, stop, step = index.indices(self._pixels)
+            if step == 1 and self._set_slice(start, stop, val):
+                if self.auto_write:
+                    self.show()
+                return
             for val_i, in_i in enumerate(range(start, stop, step)):
                 r, g, b, w = self._parse_color(val[val_i])
                 self._set_item(in_i, r, g, b, w)
@@ -289,8 +454,55 @@ class NeoPixel(Base):
         if self.auto_write:
             self.show()
 
+    def _pixel_view(self, buffer):
+        """
+        Zero-copy (pixels, bytes per pixel) NumPy view of a pixel buffer, so
+        each color channel can be addressed as a column.
+        """
+        view = np.frombuffer(buffer, dtype=np.uint8)
+        return view[self._offset:self._offset + self._bytes].reshape(
+            self._pixels, self._pixel_step
+        )
+
+    def __getstate__(self):
+        # _set_item closes over this strip's buffers, so copies rebuild their own
+        state = self.__dict__.copy()
+        del state["_set_item"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind_set_item()
+
+    def _set_slice(self, start, stop, val):
+        """
+        Write a contiguous run of full-length color tuples in one pass.
+
+        :return: ~bool: False if the values need the per-pixel path instead.
+        """
+        if self._dotstar_mode or stop - start < _VECTOR_MIN_PIXELS:
+            return False
+        try:
+            colors = np.asarray(val)
+        except ValueError:
+            return False
+        if (
+            colors.shape != (stop - start, self._bpp)
+            or colors.dtype.kind not in "iu"
+            or colors.min() < 0
+            or colors.max() > 255
+        ):
+            return False
+
+        columns = self._color_columns
+        if self._pre_brightness_buffer is not None:
+            self._pixel_view(self._pre_brightness_buffer)[start:stop, columns] = colors
+            colors = np.frombuffer(self._lut, dtype=np.uint8)[colors]
+        self._pixel_view(self._post_brightness_buffer)[start:stop, columns] = colors
+        return True
+
     def _getitem(self, index):
-        start = self._offset + (index * self._bpp)
+        start = self._offsets[index]
         buffer = (
             self._pre_brightness_buffer
             if self._pre_brightness_buffer is not None
@@ -311,11 +523,20 @@ class NeoPixel(Base):
 
     def __getitem__(self, index):
         if isinstance(index, slice):
-            out = []
-            for in_i in range(
-                *index.indices(len(self._post_brightness_buffer) // self._bpp)
-            ):
-                out.append(self._getitem(in_i))
+            indices = range(*index.indices(self._pixels))
+            if len(indices) < _VECTOR_MIN_PIXELS:
+                return [self._getitem(i) for i in indices]
+            buffer = (
+                self._pre_brightness_buffer
+                if self._pre_brightness_buffer is not None
+                else self._post_brightness_buffer
+            )
+            pixels = self._pixel_view(buffer)[index]
+            out = pixels[:, self._color_columns].tolist()
+            if self._dotstar_mode:
+                luminance = (pixels[:, self._byteorder[3]] & DOTSTAR_LED_BRIGHTNESS) / 31.0
+                for value, lum in zip(out, luminance.tolist()):
+                    value.append(lum)
             return out
         if index < 0:
             index += len(self)
@@ -336,7 +557,7 @@ class NeoPixel(Base):
         self.deinit()
 
     def __repr__(self):
-        return "[" + ", ".join([str(x) for x in self]) + "]"
+        return "[" + ", ".join(map(str, self[:])) + "]"
 
     @property
     def n(self):
@@ -347,6 +568,23 @@ class NeoPixel(Base):
 
 
 
+def _colorwheel(pos):
+    # Input a value 0 to 255 to get a color value.
+    # The colours are a transition r - g - b - back to r.
+    seg, rem = divmod(pos, 85)
+    rem3 = rem * 3
+    # pos 255 lands on segment 3 with no remainder, which is the same as segment 0
+    return (
+        (255 - rem3, rem3, 0),
+        (0, 255 - rem3, rem3),
+        (rem3, 0, 255 - rem3),
+    )[int(seg) % 3]
+
+
+# Every integer position is computed once at import
+_WHEEL_LUT = tuple(_colorwheel(pos) for pos in range(256))
+
+
 def colorwheel(pos):
     """
     Helper to create a colorwheel.
@@ -354,17 +592,13 @@ def colorwheel(pos):
     :param pos: int 0-255 of color value to return
     :return: tuple of RGB values
     """
-    # Input a value 0 to 255 to get a color value.
-    # The colours are a transition r - g - b - back to r.
-    if pos < 0 or pos > 255:
-        return 0, 0, 0
-    if pos < 85:
-        return 255 - pos * 3, pos * 3, 0
-    if pos < 170:
-        pos -= 85
-        return 0, 255 - pos * 3, pos * 3
-    pos -= 170
-    return pos * 3, 0, 255 - pos * 3
+    if 0 <= pos <= 255:
+        try:
+            return _WHEEL_LUT[pos]
+        except TypeError:
+            # Fractional positions are not in the table
+            return _colorwheel(pos)
+    return 0, 0, 0
 
 
 # Use of wheel() is deprecated. Please use colorwheel().
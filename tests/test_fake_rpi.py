@@ -1,7 +1,10 @@
 from __future__ import print_function
 
 # Faking
+import copy
+import pickle
 import sys
+import pytest
 import fake_rpi
 
 sys.modules['RPi'] = fake_rpi.RPi
@@ -75,3 +78,118 @@ def test_serial():
     s.port  = '/dev/serial'
     s.open()
     assert s.isOpen() is True
+
+
+def test_neopixel():
+    pixels = fake_rpi.neopixel.NeoPixel(None, 10, pixel_order=fake_rpi.neopixel.RGB)
+    pixels.fill((200, 100, 10))
+    assert pixels[0] == [200, 100, 10]
+    assert pixels._post_brightness_buffer[:3] == bytearray([200, 100, 10])
+
+    pixels.brightness = 0.5
+    assert pixels[9] == [200, 100, 10]
+    assert pixels._post_brightness_buffer[-3:] == bytearray([100, 50, 5])
+    pixels[1] = (255, 0, 64)
+    assert pixels._post_brightness_buffer[3:6] == bytearray([127, 0, 32])
+
+    pixels[2:4] = [(2, 4, 6), (8, 10, 12)]
+    assert pixels[2:4] == [[2, 4, 6], [8, 10, 12]]
+    assert pixels._post_brightness_buffer[6:12] == bytearray([1, 2, 3, 4, 5, 6])
+
+    pixels.brightness = 1.0
+    assert pixels._pre_brightness_buffer is None
+    assert pixels._post_brightness_buffer[:3] == bytearray([200, 100, 10])
+
+    pixels = fake_rpi.neopixel.NeoPixel(None, 20, brightness=0.5)
+    pixels[2:20] = [(i, 2 * i, 255) for i in range(18)]
+    assert pixels[19] == [17, 34, 255]
+    assert pixels[::-1][:2] == [[17, 34, 255], [16, 32, 255]]
+    assert pixels[18:] == pixels[::-1][1::-1]
+    assert repr(pixels) == "[" + ", ".join(str(pixels[i]) for i in range(20)) + "]"
+    assert pixels._post_brightness_buffer[-3:] == bytearray([17, 8, 127])
+
+    pixels = fake_rpi.neopixel.NeoPixel(None, 2, brightness=0.5)
+    pixels[1] = (255, 0, 64)
+    assert pixels[:] == [[0, 0, 0], [255, 0, 64]]
+    assert repr(pixels) == "[[0, 0, 0], [255, 0, 64]]"
+    assert pixels._post_brightness_buffer[3:] == bytearray([0, 127, 32])
+
+    with pytest.raises(ValueError):
+        pixels[0] = (1, 2, 3, 4)
+
+    pixels = fake_rpi.neopixel.NeoPixel(None, 4, pixel_order=fake_rpi.neopixel.GRBW)
+    pixels.fill((10, 20, 30))
+    assert pixels[:] == [[10, 20, 30, 0]] * 4
+    assert pixels._post_brightness_buffer[:4] == bytearray([20, 10, 30, 0])
+    # equal components without an explicit white value use the white LED
+    pixels[1] = (40, 40, 40)
+    assert pixels[1] == [0, 0, 0, 40]
+    pixels[2] = 0x050505
+    assert pixels[2] == [0, 0, 0, 5]
+
+    pixels.brightness = 0.5
+    pixels[3] = (1, 2, 3, 200)
+    assert pixels[3] == [1, 2, 3, 200]
+    assert pixels._post_brightness_buffer[12:] == bytearray([1, 0, 1, 100])
+    pixels.fill((100, 50, 8, 64))
+    assert pixels[0] == [100, 50, 8, 64]
+    assert pixels._post_brightness_buffer[:4] == bytearray([25, 50, 4, 32])
+
+
+def test_neopixel_copy():
+    for brightness in (1.0, 0.5):
+        pixels = fake_rpi.neopixel.NeoPixel(None, 3, brightness=brightness)
+        pixels[0] = (10, 20, 30)
+        for clone in (copy.deepcopy(pixels), pickle.loads(pickle.dumps(pixels))):
+            assert clone[:] == pixels[:]
+            clone[0] = (9, 9, 9)
+            clone[1] = (1, 2, 3)
+            assert pixels[:] == [[10, 20, 30], [0, 0, 0], [0, 0, 0]]
+            assert clone[:2] == [[9, 9, 9], [1, 2, 3]]
+
+
+def test_dotstar():
+    pixels = fake_rpi.neopixel.NeoPixel(None, 4, pixel_order="PBGR")
+    pixels[0] = (200, 100, 10)
+    pixels.brightness = 0.5
+    # luminance byte is left alone, colors are scaled
+    assert pixels._post_brightness_buffer[:4] == bytearray([0xFF, 5, 50, 100])
+
+    # start bytes go in the luminance column wherever P is in the order
+    pixels = fake_rpi.neopixel.NeoPixel(None, 2, pixel_order="BGRP", brightness=0.5)
+    assert pixels._post_brightness_buffer == bytearray([0, 0, 0, 0xFF] * 2)
+    assert pixels[:] == [[0, 0, 0, 1.0]] * 2
+    pixels[1] = (200, 100, 10)
+    assert pixels._post_brightness_buffer[4:] == bytearray([5, 50, 100, 0xFF])
+
+
+def test_dotstar_numba(monkeypatch):
+    pytest.importorskip("numba")
+    kernels = fake_rpi.neopixel._kernels
+    colors = [(i, (3 * i) % 256, 255 - i, (i % 32) / 31.0) for i in range(70)]
+
+    for order in ("PBGR", "BGRP", "PRGB"):
+        # 70 pixels is 280 bytes, enough for the brightness setter to use numba
+        jit = fake_rpi.neopixel.NeoPixel(None, 70, pixel_order=order)
+        jit[:] = colors
+        jit.brightness = 0.3
+
+        monkeypatch.setattr(kernels, "dotstar_brightness_kernel", lambda: None)
+        ref = fake_rpi.neopixel.NeoPixel(None, 70, pixel_order=order)
+        ref[:] = colors
+        ref.brightness = 0.3
+        monkeypatch.undo()
+
+        assert jit._post_brightness_buffer == ref._post_brightness_buffer
+        assert jit[:] == ref[:]
+
+
+def test_colorwheel():
+    colorwheel = fake_rpi.neopixel.colorwheel
+    assert colorwheel(0) == (255, 0, 0)
+    assert colorwheel(85) == (0, 255, 0)
+    assert colorwheel(170) == (0, 0, 255)
+    assert colorwheel(255) == (255, 0, 0)
+    assert colorwheel(10) == (225, 30, 0)
+    assert colorwheel(-1) == (0, 0, 0)
+    assert colorwheel(256) == (0, 0, 0)